@@ -2,6 +2,8 @@
 
 import os
 import json
+import datetime
+import hashlib
 import pinecone
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -20,6 +22,60 @@ def _chunk_text(text, chunk_size=2000, chunk_overlap=200):
         start += chunk_size - chunk_overlap
     return chunks
 
+# 매 호출마다 변하지 않는 페르소나, 규칙, 분석 절차, 출력 JSON 형식입니다.
+# 모델의 system_instruction(가능하면 캐시된 컨텍스트)으로 한 번만 등록하고, 호출마다 다시 보내지 않습니다.
+_COACHING_SYSTEM_INSTRUCTION = """[역할 및 페르소나]
+당신은 대한민국 최고의 보험 세일즈 전문가이자, 신입 설계사의 성장을 돕는 'AI 코칭 프로'입니다. 당신의 코칭 스타일은 심리학에 기반하여 고객의 마음을 얻는 것을 중요하게 생각하며, 항상 긍정적이고 전략적인 관점에서 조언합니다. 당신의 조언은 절대 딱딱하거나 사무적이지 않고, 실제 대화처럼 자연스럽고 따뜻해야 합니다.
+
+[반드시 지켜야 할 규칙]
+- 상담 내용에 명시적으로 언급되지 않은 정보는 절대 추측하거나 만들어내지 마세요.
+- [❗ 중요] `recommended_actions` 배열 안의 각 항목의 `style` 값은 반드시 서로 달라야 하며, '공감', '정보제공', '질문'의 세 가지 핵심 카테고리를 각각 대표해야 합니다.
+- [❗ 중요] 모든 추천 멘트("script")는 고객의 마음을 움직일 수 있도록, 최소 3줄에서 5줄 사이의 풍부하고 상세하며 진심이 담긴 내용으로 작성해주세요.
+- 법적 또는 규제상 민감할 수 있는 내용은 단정적으로 표현하지 말고, "일반적으로" 또는 "예를 들어"와 같은 표현을 사용하세요.
+- 분석이 불가능할 경우, 각 JSON 값에 '정보가 부족하여 분석할 수 없습니다'라고 명확히 응답하세요.
+- 멘트 스타일을 중복해서 만들지 마세요.
+
+[분석 절차 (매우 중요)]
+당신은 다음의 4단계 사고 과정을 반드시 순서대로 거쳐야 합니다.
+
+**1단계: 고객 심층 분석 (Deeper Customer Analysis)**
+- 고객의 현재 발언을 사실 그대로 분석합니다. 어떤 단어를 사용했는가? 무엇을 직접적으로 질문했는가?
+- 그 발언에 담긴 고객의 진짜 '감정(Sentiment)'과 '숨겨진 의도(Intent)'는 무엇인가?
+- 이전 대화 내용을 포함한 전체 맥락을 통해 고객의 '성향(Profile)'을 추론합니다. (예: 꼼꼼하게 따지는 분석형, 관계를 중시하는 우호형 등)
+
+**2단계: 맥락 및 데이터 연결 (Context & Data Connection)**
+- 1단계 분석 결과를, 제공된 '[분석에 참고할 전문가 지식 (RAG 결과)]'와 연결합니다.
+- "이 고객의 상황이 우리 회사의 성공/실패 사례 중 어떤 것과 유사한가?"
+- "이 고객의 질문에 답하기 위해, 우리 '비법 노트'에서 어떤 내용을 참고해야 하는가?"
+
+**3단계: 핵심 문제(반론) 정의 및 전략 수립 (Problem Definition & Strategy Formulation)**
+- 1, 2단계 분석을 종합하여, 현재 상담을 다음 단계로 진전시키기 위해 해결해야 할 '가장 중요한 핵심 문제' 또는 '예상되는 고객의 핵심 반론'을 한 문장으로 정의합니다.
+- 이 문제를 해결하기 위한 '대응 전략'을 수립합니다. (예: '비용 저항이므로, 가치에 초점을 맞춰 설명하는 전략', '결정장애를 보이므로, 선택지를 2개로 좁혀주는 전략' 등)
+
+**4단계: 최종 코칭 생성 (Generate Final Coaching)**
+- 위 3단계에서 수립된 전략을 바탕으로, 아래 [출력 JSON 형식]의 모든 항목을 구체적이고 실행 가능한 내용으로 채웁니다. 모든 내용은 지금까지의 단계별 사고 과정과 완벽하게 일치해야 합니다.
+---
+
+[출력 JSON 형식 및 지침]
+{
+  "customer_intent": "고객의 가장 핵심적인 질문 의도나 니즈를 한 문장으로 요약",
+  "customer_sentiment": "현재 고객의 감정 상태 (예: 궁금함, 우려함, 긍정적, 부정적, 신중함)",
+  "customer_profile_guess": "지금까지의 대화를 바탕으로 추정한 고객 성향 (예: 분석형, 관계중시형, 신중형)",
+  "objection_handling_strategy": {
+      "predicted_objection": "AI가 예측하는 고객의 다음 반론이나 망설임 포인트",
+      "counter_strategy": "예측된 반론에 대한 대응 전략 요약",
+      "example_script": "그 전략을 현장에서 바로 실행할 수 있는, 3~5줄의 설득력 있는 추천 멘트"
+  },
+  "recommended_actions": [
+    {"style": "공감 및 관계 형성", "script": "최소 3~5줄의 풍부하고 상세하며, 진심이 담긴 구체적인 멘트"},
+    {"style": "핵심 니즈 확인 질문", "script": "고객의 니즈를 더 명확히 하거나, 숨겨진 니즈를 발견하기 위한 구체적인 질문 멘트"},
+    {"style": "논리적 설득 및 정보 제공", "script": "최소 3~5줄의 풍부하고 상세하며, 고객이 이해하기 쉬운 구체적인 멘트"},
+    {"style": "다음 단계 유도 및 질문", "script": "최소 3~5줄의 풍부하고 상세하며, 자연스럽게 다음 대화를 이끌어내는 구체적인 질문 멘트"}
+  ],
+  "next_step_strategy": "현재 상황에서 가장 효과적인 다음 상담 진행 방향 및 전략에 대한 조언"
+}
+"""
+
 class AICoachingService:
     def __init__(self):
         load_dotenv()
@@ -33,9 +89,81 @@ class AICoachingService:
         self.index_name = "insurance-coach"
         self.embedding_model = 'models/text-embedding-004'
         self._initialize_pinecone_index()
-        self.model = genai.GenerativeModel('gemini-1.5-pro-latest', generation_config={"response_mime_type": "application/json"})
+        # 캐시 경로와 대체 경로가 같은 모델 버전을 쓰도록 버전을 고정합니다. (컨텍스트 캐시는 버전이 고정된 모델만 지원)
+        self.coaching_model_name = 'models/gemini-1.5-pro-002'
+        # 지침 내용이 바뀌면 예전 캐시를 재사용하지 않도록 이름에 내용 해시를 넣습니다.
+        self.cache_display_name = f"insurance-coach-{hashlib.sha256(_COACHING_SYSTEM_INSTRUCTION.encode('utf-8')).hexdigest()[:12]}"
+        # Gemini 1.5 Pro 컨텍스트 캐시의 최소 토큰 수입니다. 현재 지침은 이보다 훨씬 짧으므로 실제로는
+        # system_instruction 경로가 사용되며, 지침이 이 크기를 넘으면 캐시 경로로 전환됩니다.
+        self.cache_min_tokens = 32768
+        self.cache_ttl = datetime.timedelta(hours=1)
+        self.cache_refresh_margin = datetime.timedelta(minutes=5)
+        self._setup_coaching_model()
         print("✅ AI 코칭 서비스가 (Pinecone과 함께) 성공적으로 초기화되었습니다.")
 
+    def _setup_coaching_model(self):
+        """고정 코칭 지침을 한 번만 등록합니다. 캐시 최소 크기를 넘으면 캐시된 컨텍스트로, 아니면 system_instruction 모델로 등록합니다."""
+        self._cached_content = None
+        self._cache_expires_at = None
+        try:
+            token_count = genai.GenerativeModel(self.coaching_model_name).count_tokens(_COACHING_SYSTEM_INSTRUCTION).total_tokens
+        except Exception as e:
+            print(f"⚠️ 코칭 지침의 토큰 수를 확인할 수 없어 system_instruction으로 등록합니다: {e}")
+            self._use_system_instruction_model()
+            return
+        if token_count < self.cache_min_tokens:
+            print(f"✅ 코칭 지침({token_count} 토큰)이 캐시 최소 크기({self.cache_min_tokens} 토큰)보다 작아 system_instruction으로 등록합니다.")
+            self._use_system_instruction_model()
+            return
+        try:
+            from google.generativeai import caching
+            self._cached_content = self._find_or_create_cache(caching)
+            self._cache_expires_at = datetime.datetime.now(datetime.timezone.utc) + self.cache_ttl
+            self.model = genai.GenerativeModel.from_cached_content(cached_content=self._cached_content, generation_config={"response_mime_type": "application/json"})
+            self._inline_system_instruction = False
+            print(f"✅ 코칭 지침을 캐시된 컨텍스트로 등록했습니다. (TTL: {self.cache_ttl})")
+        except Exception as e:
+            print(f"⚠️ 컨텍스트 캐시를 사용할 수 없어 system_instruction으로 대체합니다: {e}")
+            self._use_system_instruction_model()
+
+    def _find_or_create_cache(self, caching):
+        # gunicorn 워커나 재시작마다 새 캐시가 쌓이지 않도록, 같은 이름과 모델의 캐시가 있으면 TTL만 연장해 재사용합니다.
+        for cached_content in caching.CachedContent.list():
+            if cached_content.display_name == self.cache_display_name and cached_content.model == self.coaching_model_name:
+                cached_content.update(ttl=self.cache_ttl)
+                return cached_content
+        return caching.CachedContent.create(
+            model=self.coaching_model_name,
+            display_name=self.cache_display_name,
+            system_instruction=_COACHING_SYSTEM_INSTRUCTION,
+            ttl=self.cache_ttl,
+        )
+
+    def _use_system_instruction_model(self):
+        self._cached_content = None
+        self._cache_expires_at = None
+        try:
+            self.model = genai.GenerativeModel(self.coaching_model_name, generation_config={"response_mime_type": "application/json"}, system_instruction=_COACHING_SYSTEM_INSTRUCTION)
+            self._inline_system_instruction = False
+        except TypeError:
+            # system_instruction 인자를 모르는 구버전 SDK에서는 지침을 프롬프트에 직접 포함합니다.
+            self.model = genai.GenerativeModel(self.coaching_model_name, generation_config={"response_mime_type": "application/json"})
+            self._inline_system_instruction = True
+
+    def _refresh_cache_if_needed(self):
+        """캐시 만료가 가까우면 TTL을 연장합니다. 이미 만료됐거나 연장에 실패하면 캐시를 한 번 다시 등록하고, 그래도 안 되면 system_instruction 모델로 전환합니다."""
+        if self._cached_content is None: return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self._cache_expires_at - now > self.cache_refresh_margin: return
+        if self._cache_expires_at > now:
+            try:
+                self._cached_content.update(ttl=self.cache_ttl)
+                self._cache_expires_at = now + self.cache_ttl
+                return
+            except Exception as e:
+                print(f"🔥 컨텍스트 캐시 TTL 연장 중 오류 발생, 캐시를 다시 등록합니다: {e}")
+        self._setup_coaching_model()
+
     def _initialize_pinecone_index(self):
         if self.index_name not in self.pinecone.list_indexes().names():
              raise ValueError(f"Pinecone에 '{self.index_name}' 인덱스가 없습니다. Pinecone 대시보드에서 먼저 생성해주세요.")
@@ -106,62 +234,10 @@ class AICoachingService:
             return text
 
     def _build_prompt(self, consultation_text, history, relevant_knowledge):
-        # 프롬프트 내용은 이전 최종본과 동일합니다.
+        # 고정 지침은 system_instruction으로 분리되어 있으므로, 호출마다 바뀌는 내용만 구성합니다.
         history_str = "\n".join(history) if history else "없음"
         knowledge_str = "\n---\n".join(relevant_knowledge) if relevant_knowledge else "참고할 만한 전문가 지식 없음"
-        return f"""
-        [역할 및 페르소나]
-        당신은 대한민국 최고의 보험 세일즈 전문가이자, 신입 설계사의 성장을 돕는 'AI 코칭 프로'입니다. 당신의 코칭 스타일은 심리학에 기반하여 고객의 마음을 얻는 것을 중요하게 생각하며, 항상 긍정적이고 전략적인 관점에서 조언합니다. 당신의 조언은 절대 딱딱하거나 사무적이지 않고, 실제 대화처럼 자연스럽고 따뜻해야 합니다.
-
-        [반드시 지켜야 할 규칙]
-        - 상담 내용에 명시적으로 언급되지 않은 정보는 절대 추측하거나 만들어내지 마세요.
-        - [❗ 중요] `recommended_actions` 배열 안의 각 항목의 `style` 값은 반드시 서로 달라야 하며, '공감', '정보제공', '질문'의 세 가지 핵심 카테고리를 각각 대표해야 합니다.
-        - [❗ 중요] 모든 추천 멘트("script")는 고객의 마음을 움직일 수 있도록, 최소 3줄에서 5줄 사이의 풍부하고 상세하며 진심이 담긴 내용으로 작성해주세요.
-        - 법적 또는 규제상 민감할 수 있는 내용은 단정적으로 표현하지 말고, "일반적으로" 또는 "예를 들어"와 같은 표현을 사용하세요.
-        - 분석이 불가능할 경우, 각 JSON 값에 '정보가 부족하여 분석할 수 없습니다'라고 명확히 응답하세요.
-        - 멘트 스타일을 중복해서 만들지 마세요.
-
-        [분석 절차 (매우 중요)]
-        당신은 다음의 4단계 사고 과정을 반드시 순서대로 거쳐야 합니다.
-
-        **1단계: 고객 심층 분석 (Deeper Customer Analysis)**
-        - 고객의 현재 발언을 사실 그대로 분석합니다. 어떤 단어를 사용했는가? 무엇을 직접적으로 질문했는가?
-        - 그 발언에 담긴 고객의 진짜 '감정(Sentiment)'과 '숨겨진 의도(Intent)'는 무엇인가?
-        - 이전 대화 내용을 포함한 전체 맥락을 통해 고객의 '성향(Profile)'을 추론합니다. (예: 꼼꼼하게 따지는 분석형, 관계를 중시하는 우호형 등)
-
-        **2단계: 맥락 및 데이터 연결 (Context & Data Connection)**
-        - 1단계 분석 결과를, 제공된 '[분석에 참고할 전문가 지식 (RAG 결과)]'와 연결합니다.
-        - "이 고객의 상황이 우리 회사의 성공/실패 사례 중 어떤 것과 유사한가?"
-        - "이 고객의 질문에 답하기 위해, 우리 '비법 노트'에서 어떤 내용을 참고해야 하는가?"
-
-        **3단계: 핵심 문제(반론) 정의 및 전략 수립 (Problem Definition & Strategy Formulation)**
-        - 1, 2단계 분석을 종합하여, 현재 상담을 다음 단계로 진전시키기 위해 해결해야 할 '가장 중요한 핵심 문제' 또는 '예상되는 고객의 핵심 반론'을 한 문장으로 정의합니다.
-        - 이 문제를 해결하기 위한 '대응 전략'을 수립합니다. (예: '비용 저항이므로, 가치에 초점을 맞춰 설명하는 전략', '결정장애를 보이므로, 선택지를 2개로 좁혀주는 전략' 등)
-
-        **4단계: 최종 코칭 생성 (Generate Final Coaching)**
-        - 위 3단계에서 수립된 전략을 바탕으로, 아래 [출력 JSON 형식]의 모든 항목을 구체적이고 실행 가능한 내용으로 채웁니다. 모든 내용은 지금까지의 단계별 사고 과정과 완벽하게 일치해야 합니다.
-        ---
-
-        [출력 JSON 형식 및 지침]
-        {{
-          "customer_intent": "고객의 가장 핵심적인 질문 의도나 니즈를 한 문장으로 요약",
-          "customer_sentiment": "현재 고객의 감정 상태 (예: 궁금함, 우려함, 긍정적, 부정적, 신중함)",
-          "customer_profile_guess": "지금까지의 대화를 바탕으로 추정한 고객 성향 (예: 분석형, 관계중시형, 신중형)",
-          "objection_handling_strategy": {{
-              "predicted_objection": "AI가 예측하는 고객의 다음 반론이나 망설임 포인트",
-              "counter_strategy": "예측된 반론에 대한 대응 전략 요약",
-              "example_script": "그 전략을 현장에서 바로 실행할 수 있는, 3~5줄의 설득력 있는 추천 멘트"
-          }},
-          "recommended_actions": [
-            {{"style": "공감 및 관계 형성", "script": "최소 3~5줄의 풍부하고 상세하며, 진심이 담긴 구체적인 멘트"}},
-            {{"style": "핵심 니즈 확인 질문", "script": "고객의 니즈를 더 명확히 하거나, 숨겨진 니즈를 발견하기 위한 구체적인 질문 멘트"}},
-            {{"style": "논리적 설득 및 정보 제공", "script": "최소 3~5줄의 풍부하고 상세하며, 고객이 이해하기 쉬운 구체적인 멘트"}},
-            {{"style": "다음 단계 유도 및 질문", "script": "최소 3~5줄의 풍부하고 상세하며, 자연스럽게 다음 대화를 이끌어내는 구체적인 질문 멘트"}}
-          ],
-          "next_step_strategy": "현재 상황에서 가장 효과적인 다음 상담 진행 방향 및 전략에 대한 조언"
-        }}
-
-        ---
+        prompt = f"""
         [분석에 참고할 전문가 지식 (RAG 결과)]
         {knowledge_str}
         ---
@@ -172,6 +248,10 @@ class AICoachingService:
         {consultation_text}
         ---
         """
+        if self._inline_system_instruction:
+            # system_instruction을 지원하지 않는 SDK에서는 기존처럼 고정 지침을 프롬프트 앞에 붙입니다.
+            return f"{_COACHING_SYSTEM_INSTRUCTION}\n---\n{prompt}"
+        return prompt
 
     def analyze_consultation(self, consultation_text, history):
         """상담 내용을 분석하고 최종 코칭 결과를 반환합니다."""
@@ -179,9 +259,11 @@ class AICoachingService:
         try:
             # RAG 검색
             relevant_knowledge = self.retrieve_relevant_knowledge(consultation_text)
+            # 캐시 갱신/대체로 모델이 바뀔 수 있으므로, 프롬프트를 만들기 전에 먼저 확인합니다.
+            self._refresh_cache_if_needed()
             # 프롬프트 구성
             prompt = self._build_prompt(consultation_text, history, relevant_knowledge)
-            # Gemini API 호출
+            # Gemini API 호출 (고정 지침은 캐시/system_instruction으로 이미 등록되어 있음)
             response = self.model.generate_content(prompt)
             
             if not response.parts:
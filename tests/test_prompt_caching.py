@@ -0,0 +1,197 @@
+# 파일명: tests/test_prompt_caching.py
+# 고정 코칭 지침이 호출마다 다시 전송되지 않는지, 캐시를 쓸 수 없을 때 대체 경로로 전환되는지 확인합니다.
+# Gemini/Pinecone 실제 API 대신 로컬 가짜(fake) 모듈을 사용합니다.
+
+import datetime
+import importlib
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+class FakeResponse:
+    parts = [object()]
+    text = '{"customer_intent": "보험료 부담"}'
+
+
+class FakeGenerativeModel:
+    token_count = 1000
+    sent_prompts = []
+
+    def __init__(self, model_name, generation_config=None, system_instruction=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content, generation_config=None):
+        model = cls(cached_content.model, generation_config=generation_config)
+        model.cached_content = cached_content
+        return model
+
+    def count_tokens(self, contents):
+        return types.SimpleNamespace(total_tokens=FakeGenerativeModel.token_count)
+
+    def generate_content(self, prompt):
+        FakeGenerativeModel.sent_prompts.append(prompt)
+        return FakeResponse()
+
+
+class FakeCachedContent:
+    existing = []
+    create_error = None
+    update_error = None
+    created = 0
+
+    def __init__(self, model, display_name):
+        self.model = model
+        self.display_name = display_name
+
+    @classmethod
+    def list(cls):
+        return list(cls.existing)
+
+    @classmethod
+    def create(cls, model, display_name, system_instruction, ttl):
+        if cls.create_error: raise cls.create_error
+        cls.created += 1
+        return cls(model, display_name)
+
+    def update(self, ttl):
+        if FakeCachedContent.update_error: raise FakeCachedContent.update_error
+
+
+class FakeIndex:
+    def describe_index_stats(self):
+        return {'total_vector_count': 1}
+
+    def query(self, vector, top_k, include_metadata):
+        return {'matches': [{'metadata': {'text': '비용 저항 고객에게는 가치 중심으로 설명합니다.'}}]}
+
+
+class FakePinecone:
+    def __init__(self, api_key):
+        pass
+
+    def list_indexes(self):
+        return types.SimpleNamespace(names=lambda: ['insurance-coach'])
+
+    def Index(self, name):
+        return FakeIndex()
+
+
+def _fake_modules():
+    genai = types.ModuleType('google.generativeai')
+    genai.configure = lambda api_key: None
+    genai.embed_content = lambda model, content: {'embedding': [[0.0, 0.1]] * len(content)}
+    genai.GenerativeModel = FakeGenerativeModel
+    caching = types.ModuleType('google.generativeai.caching')
+    caching.CachedContent = FakeCachedContent
+    genai.caching = caching
+    google = types.ModuleType('google')
+    google.generativeai = genai
+    pinecone = types.ModuleType('pinecone')
+    pinecone.Pinecone = FakePinecone
+    dotenv = types.ModuleType('dotenv')
+    dotenv.load_dotenv = lambda: None
+    pypdf = types.ModuleType('pypdf')
+    pypdf.PdfReader = None
+    docx = types.ModuleType('docx')
+    docx.Document = None
+    return {
+        'google': google, 'google.generativeai': genai, 'google.generativeai.caching': caching,
+        'pinecone': pinecone, 'dotenv': dotenv, 'pypdf': pypdf, 'docx': docx,
+    }
+
+
+class PromptCachingTest(unittest.TestCase):
+    def setUp(self):
+        FakeGenerativeModel.token_count = 40000
+        FakeGenerativeModel.sent_prompts = []
+        FakeCachedContent.existing = []
+        FakeCachedContent.create_error = None
+        FakeCachedContent.update_error = None
+        FakeCachedContent.created = 0
+        patchers = [
+            mock.patch.dict(sys.modules, _fake_modules()),
+            mock.patch.dict(os.environ, {'PINECONE_API_KEY': 'key', 'PINECONE_ENVIRONMENT': 'env', 'GOOGLE_API_KEY': 'key'}),
+            mock.patch('builtins.print'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        sys.modules.pop('services', None)
+        self.services = importlib.import_module('services')
+        self.addCleanup(sys.modules.pop, 'services', None)
+
+    def _analyze(self, service):
+        result, history, error = service.analyze_consultation("고객: 보험료가 너무 비싼 것 같아요.", ["---고객/설계사 대화---\n이전 상담"])
+        self.assertIsNone(error)
+        return FakeGenerativeModel.sent_prompts[-1]
+
+    def test_cached_call_sends_only_dynamic_content(self):
+        service = self.services.AICoachingService()
+        self.assertIsNotNone(service.model.cached_content)
+
+        prompt = self._analyze(service)
+        instruction = self.services._COACHING_SYSTEM_INSTRUCTION
+        self.assertNotIn(instruction, prompt)
+        self.assertNotIn("[역할 및 페르소나]", prompt)
+        self.assertIn("비용 저항 고객에게는", prompt)
+        self.assertIn("이전 상담", prompt)
+        self.assertIn("보험료가 너무 비싼 것 같아요", prompt)
+        baseline_length = len(instruction) + len(prompt)
+        self.assertLess(len(prompt), baseline_length / 4)
+
+    def test_existing_cache_is_reused(self):
+        first = self.services.AICoachingService()
+        FakeCachedContent.existing = [first._cached_content]
+        second = self.services.AICoachingService()
+        self.assertIs(second._cached_content, first._cached_content)
+        self.assertEqual(FakeCachedContent.created, 1)
+        self.assertEqual(second.model.model_name, second.coaching_model_name)
+
+    def test_small_instruction_uses_system_instruction_without_cache(self):
+        FakeGenerativeModel.token_count = 1000
+        service = self.services.AICoachingService()
+        self.assertIsNone(service._cached_content)
+        self.assertEqual(FakeCachedContent.created, 0)
+        self.assertEqual(service.model.system_instruction, self.services._COACHING_SYSTEM_INSTRUCTION)
+        self.assertNotIn("[역할 및 페르소나]", self._analyze(service))
+
+    def test_falls_back_to_system_instruction_when_cache_create_fails(self):
+        FakeCachedContent.create_error = RuntimeError("cache unavailable")
+        service = self.services.AICoachingService()
+        self.assertIsNone(service._cached_content)
+        self.assertEqual(service.model.system_instruction, self.services._COACHING_SYSTEM_INSTRUCTION)
+        self.assertEqual(service.model.model_name, service.coaching_model_name)
+        self.assertNotIn("[역할 및 페르소나]", self._analyze(service))
+
+    def test_falls_back_to_system_instruction_when_ttl_update_fails(self):
+        service = self.services.AICoachingService()
+        service._cache_expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1)
+        FakeCachedContent.update_error = RuntimeError("cache expired")
+        FakeCachedContent.create_error = RuntimeError("cache unavailable")
+
+        prompt = self._analyze(service)
+        self.assertIsNone(service._cached_content)
+        self.assertEqual(service.model.system_instruction, self.services._COACHING_SYSTEM_INSTRUCTION)
+        self.assertNotIn("[역할 및 페르소나]", prompt)
+
+    def test_expired_cache_is_recreated(self):
+        service = self.services.AICoachingService()
+        service._cache_expires_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=1)
+
+        self._analyze(service)
+        self.assertEqual(FakeCachedContent.created, 2)
+        self.assertIsNotNone(service.model.cached_content)
+
+
+if __name__ == '__main__':
+    unittest.main()